@@ -1,8 +1,15 @@
 import re
+import threading
 import time
 from xmlrpc.client import Fault
 from xmlrpc.client import ServerProxy
 
+# Fault messages from PyPI are of these forms:
+#   The action could not be performed because there were too many requests by the client. Limit may reset in 1 seconds.
+#   The action could not be performed because there were too many requests by the client.
+_LIMIT_RESET_RE = re.compile(r"Limit may reset in (\d+) seconds\.$")
+_TOO_MANY_REQUESTS_RE = re.compile(r"too many requests by the client\.$")
+
 
 class RateLimitedProxy:
     """
@@ -11,11 +18,21 @@ class RateLimitedProxy:
     based on the return messages from PyPI. The need for rate limiting is due to the issue described in
     https://github.com/pypa/warehouse/issues/8753.
 
+    Requests are pre-throttled through a token bucket (``rate`` requests per
+    second, with a burst of ``burst``), so calls which PyPI would reject anyway
+    are delayed instead of sent; reacting to the Fault afterwards is kept only
+    as a fallback, since it wastes a full round-trip per rejected call.
+
     Note that this class should be deprecated with a migration to PyPIJSON: https://wiki.python.org/moin/PyPIJSON
     """
 
-    def __init__(self, uri):
+    def __init__(self, uri, rate=1.0, burst=5):
         self._server_proxy = ServerProxy(uri)
+        self._rate = rate
+        self._max_tokens = float(burst)
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
 
     def browse(self, classifiers):
         return self._rate_limit_request(self._server_proxy.browse, classifiers)
@@ -32,29 +49,34 @@ class RateLimitedProxy:
     def release_urls(self, name, version):
         return self._rate_limit_request(self._server_proxy.release_urls, name, version)
 
+    def _acquire_token(self):
+        """Blocks until the token bucket allows one more request to be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._max_tokens, self._tokens + (now - self._last_refill) * self._rate
+            )
+            self._last_refill = now
+            if self._tokens < 1:
+                time.sleep((1 - self._tokens) / self._rate)
+                self._last_refill = time.monotonic()
+                self._tokens = 1.0
+            self._tokens -= 1
+
     def _rate_limit_request(self, request_method, *args):
         while True:
+            self._acquire_token()
             try:
                 return request_method(*args)
             except Fault as fault:
-                # If PyPI errors due to too many requests, sleep and try again depending on the error message received
-                # The fault message is of form:
-                #   The action could not be performed because there were too many requests by the client. Limit may reset in 1 seconds.
-                limit_reset_regex_match = re.search(
-                    r"^.+Limit may reset in (\d+) seconds\.$", fault.faultString
-                )
+                # If PyPI errors due to too many requests anyway, sleep and try
+                # again depending on the error message received
+                limit_reset_regex_match = _LIMIT_RESET_RE.search(fault.faultString)
                 if limit_reset_regex_match is not None:
-                    sleep_amt = int(limit_reset_regex_match.group(1))
-                    time.sleep(sleep_amt)
+                    time.sleep(int(limit_reset_regex_match.group(1)))
                     continue
 
-                # The fault message is of form:
-                #   The action could not be performed because there were too many requests by the client.
-                too_many_requests_regex_match = re.search(
-                    "^.+The action could not be performed because there were too many requests by the client.$",
-                    fault.faultString,
-                )
-                if too_many_requests_regex_match is not None:
+                if _TOO_MANY_REQUESTS_RE.search(fault.faultString) is not None:
                     time.sleep(60)
                     continue
 
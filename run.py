@@ -14,6 +14,8 @@ a dependency when invoking tox.
 Once all results are obtained, they are posted to the plugincompat heroku app
 which can then be visualized.
 """
+import gzip
+import hashlib
 import json
 import os
 import shutil
@@ -23,12 +25,14 @@ import tarfile
 import time
 import traceback
 from argparse import ArgumentParser
-from collections import defaultdict
 from collections import namedtuple
 from contextlib import closing
-from functools import partial
+from io import BytesIO
 from io import StringIO
+from string import Template
+from tempfile import gettempdir
 from tempfile import mkdtemp
+from tempfile import mkstemp
 from typing import List
 from typing import Optional
 from zipfile import ZipFile
@@ -36,67 +40,204 @@ from zipfile import ZipFile
 import asks
 import attr
 import colorama
-import distlib
+import orjson
 import trio
 from colorama import Fore
-from distlib.wheel import is_compatible
-from wimpy.util import strip_suffix
+from packaging.tags import sys_tags
+from packaging.utils import InvalidWheelFilename
+from packaging.utils import parse_wheel_filename
 from wimpy.util import working_directory
 
 import update_index
-from pypi_rpc_client.proxy import RateLimitedProxy
-
-
-async def download_package(client, session, name, version):
-    urls = client.release_urls(name, version)
-    dists = defaultdict(list)
-    for data in urls:
-        dists[data.get("packagetype")].append(data)
-    url = fname = None
-    for sdist in dists["sdist"]:
-        url = sdist["url"]
-        fname = sdist["filename"]
-        break
-    else:
-        for bdist in dists["bdist_wheel"]:
-            try:
-                if not is_compatible(bdist["filename"]):
-                    continue
-            except distlib.DistlibException:
-                # is_compatible may also raise exceptions with invalid wheel
-                # files instead of returning False :/
-                continue
-            else:
-                url = bdist["url"]
-                fname = bdist["filename"]
-                break
-    if fname is not None:
-        response = await session.get(url)
-        await trio.Path(fname).write_bytes(response.content)
-        return fname
 
 
-def extract(basename):
+class _NullFore:
+    """
+    Drop-in for colorama.Fore with empty color codes; plain class attributes
+    so styled prints cost a simple attribute read instead of escape handling.
+    """
+
+    GREEN = YELLOW = CYAN = LIGHTCYAN_EX = MAGENTA = RED = RESET = ""
+
+
+if os.environ.get("PLUGINCOMPAT_NO_COLOR"):
+    Fore = _NullFore
+
+# Directory where PyPI JSON metadata responses are cached between runs.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pypi-cache")
+
+# append-only log of handled packages, used to resume interrupted runs
+# without submitting the same packages all over again
+DONE_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".plugincompat.done.jsonl")
+
+# tags supported by the current interpreter, used to select compatible wheels
+COMPATIBLE_TAGS = frozenset(sys_tags())
+
+# buffer size for archive extraction; tarfile defaults to 16 KiB blocks,
+# which means 16x more write syscalls than needed for multi-MB sdists
+EXTRACT_BUFSIZE = 256 * 1024
+
+# maps archive suffix to the function which opens it; built once instead of
+# per call, ordered so the overwhelmingly common sdist suffix is tried first,
+# and tarballs use an explicit mode so tarfile never has to sniff the
+# compression by re-reading the stream
+EXTRACTORS = {
+    ".tar.gz": lambda f: tarfile.open(fileobj=f, mode="r|gz", bufsize=EXTRACT_BUFSIZE),
+    ".tgz": lambda f: tarfile.open(fileobj=f, mode="r|gz", bufsize=EXTRACT_BUFSIZE),
+    ".zip": ZipFile,
+}
+
+# pip cache shared by every tox-spawned pip, so the dependencies common to
+# most plugins are downloaded and built only once per machine
+SHARED_PIP_CACHE = os.path.join(gettempdir(), "plugincompat-pipcache")
+
+# persistent tox work dirs, keyed per package, so a re-run on the same
+# machine reuses the virtualenv built last time instead of recreating it
+# (the scratch dirs holding the sources themselves are still deleted)
+SHARED_TOX_WORKDIR = os.path.join(gettempdir(), "plugincompat-toxwork")
+
+
+def is_compatible(filename):
+    """
+    Returns True if the given wheel filename is compatible with the current
+    interpreter; invalid wheel filenames are simply not compatible.
+    """
+    try:
+        tags = parse_wheel_filename(filename)[3]
+    except InvalidWheelFilename:
+        return False
+    return not COMPATIBLE_TAGS.isdisjoint(tags)
+
+
+@attr.s
+class MetadataCache:
+    """
+    On-disk cache of PyPI JSON metadata responses, keyed by (name, version),
+    and of the downloaded archives themselves, keyed by filename.
+
+    The files published for a given release never change, so cached entries
+    can be reused across runs, skipping the network round-trip entirely.
+    """
+
+    _directory = attr.ib(converter=trio.Path)
+
+    def _entry_path(self, name, version):
+        return self._directory / "{}-{}.json".format(name, version)
+
+    async def get(self, name, version):
+        try:
+            contents = await self._entry_path(name, version).read_text()
+        except OSError:
+            return None
+        try:
+            return json.loads(contents)
+        except ValueError:
+            return None
+
+    async def set(self, name, version, data):
+        await self._directory.mkdir(parents=True, exist_ok=True)
+        await self._entry_path(name, version).write_text(json.dumps(data))
+
+    async def get_archive(self, filename):
+        try:
+            return await (self._directory / filename).read_bytes()
+        except OSError:
+            return None
+
+    async def set_archive(self, filename, contents):
+        await self._directory.mkdir(parents=True, exist_ok=True)
+        await (self._directory / filename).write_bytes(contents)
+
+
+async def fetch_metadata(cache, session, name, version):
+    """
+    Returns the PyPI JSON metadata for the given package, from the cache when
+    available, or None if PyPI doesn't know about this release.
     """
-    Extracts the contents of the given archive into the current directory.
+    data = await cache.get(name, version)
+    if data is None:
+        response = await session.get("https://pypi.org/pypi/{}/{}/json".format(name, version))
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        await cache.set(name, version, data)
+    return data
+
+
+async def download_package(cache, session, name, version):
+    data = await fetch_metadata(cache, session, name, version)
+    url = fname = sha256 = None
+    # single pass: an sdist always wins, otherwise the first compatible wheel
+    for dist in data["urls"] if data else []:
+        packagetype = dist.get("packagetype")
+        if packagetype == "sdist":
+            url = dist["url"]
+            fname = dist["filename"]
+            sha256 = dist.get("digests", {}).get("sha256")
+            break
+        elif packagetype == "bdist_wheel" and fname is None:
+            if is_compatible(dist["filename"]):
+                url = dist["url"]
+                fname = dist["filename"]
+                sha256 = dist.get("digests", {}).get("sha256")
+    if fname is not None:
+        # release files are immutable, so a cached archive is always valid
+        contents = await cache.get_archive(fname)
+        if contents is None:
+            response = await session.get(url)
+            contents = response.content
+            # only cache archives matching the digest PyPI advertises, so a
+            # corrupted transfer is downloaded again on the next run
+            if sha256 is None or hashlib.sha256(contents).hexdigest() == sha256:
+                await cache.set_archive(fname, contents)
+        return fname, contents
+
+
+def extract(basename, fileobj, directory="."):
+    """
+    Extracts the archive contents into the given directory, straight from
+    the downloaded bytes, without writing the archive itself to disk first.
 
-    :param basename: name of the archive related to the current directory
+    :param basename: name of the archive, used to select the extractor
     :type basename: str
 
-    :rtype: str
-    :return: the name of the directory where the contents where extracted
+    :param fileobj: binary file object with the archive contents
+
+    :param directory: directory where the contents are extracted into
+    :type directory: str
+
+    :rtype: tuple
+    :return: (name of the directory where the contents where extracted,
+        whether the archive ships its own top-level tox.ini)
     """
 
-    extractors = {".zip": ZipFile, ".tar.gz": tarfile.open, ".tgz": tarfile.open}
-    for ext, extractor in extractors.items():
+    for ext, extractor in EXTRACTORS.items():
         if basename.endswith(ext):
-            with closing(extractor(basename)) as f:
-                f.extractall(".")
-            return basename[: -len(ext)]
+            stripped = basename[: -len(ext)]
+            # peek at the member names while we have the archive open, so
+            # run_tox doesn't need to stat for tox.ini afterwards
+            expected_tox = "{}/tox.ini".format(stripped)
+            with closing(extractor(fileobj)) as f:
+                if isinstance(f, ZipFile):
+                    has_tox = expected_tox in f.namelist()
+                    f.extractall(directory)
+                else:
+                    # tarballs are opened in stream mode ("r|gz"), so the
+                    # archive is decompressed in a single forward pass and
+                    # each member is vetted and extracted as it goes by
+                    has_tox = False
+                    for member in f:
+                        name = member.name
+                        if name.startswith("/") or ".." in name.split("/"):
+                            continue
+                        if name == expected_tox:
+                            has_tox = True
+                        f.extract(member, directory)
+            return os.path.join(directory, stripped), has_tox
     raise Exception("could not extract %s" % basename)
 
 
-async def run_tox(target, tox_env, pytest_version, mode="sdist"):
+async def run_tox(target, tox_env, pytest_version, mode="sdist", has_tox=False):
     """
     Runs tox on the given directory and return (exit code, output)
     """
@@ -104,39 +245,72 @@ async def run_tox(target, tox_env, pytest_version, mode="sdist"):
         directory = target
         PLACEHOLDER_TOX = PLACEHOLDER_TOX_SDIST
     elif mode == "bdist_wheel":
-        directory = strip_suffix(target, ".whl")
-        os.makedirs(directory)
-        PLACEHOLDER_TOX = PLACEHOLDER_TOX_BDIST.format(wheel_fname=target)
+        # wheels need no extraction, pip installs them by (absolute) path; the
+        # scratch directory only exists to hold the generated tox.ini, so keep
+        # its name short instead of mirroring the full wheel filename
+        directory = mkdtemp(prefix="bdist-", dir=os.path.dirname(target) or ".")
+        PLACEHOLDER_TOX = PLACEHOLDER_TOX_BDIST.substitute(wheel_fname=os.path.abspath(target))
     else:
         raise NotImplementedError
-    tox_file = os.path.join(directory, "tox.ini")
-    if not os.path.isfile(tox_file):
-        with open(tox_file, "w") as f:
-            f.write(PLACEHOLDER_TOX)
-
-    cmdline = "tox --result-json=result.json -e %s --force-dep=pytest==%s"
-    cmdline %= (tox_env, pytest_version)
-    args = cmdline.split()
+    # when the caller already knows the package ships a tox.ini (from the
+    # archive index), skip the stat; otherwise double check on disk
+    if not has_tox:
+        tox_file = os.path.join(directory, "tox.ini")
+        if not os.path.isfile(tox_file):
+            with open(tox_file, "w") as f:
+                f.write(PLACEHOLDER_TOX)
+
+    args = list(TOX_ARGV_TEMPLATE)
+    args[3] = tox_env
+    args[5] = "pytest==" + pytest_version
+    args[7] = os.path.join(SHARED_TOX_WORKDIR, os.path.basename(target))
+
+    # cut pip's per-run startup work (self version check, prompts, .pyc
+    # writes) and share its cache across every plugin
+    env = {
+        **os.environ,
+        "PIP_DISABLE_PIP_VERSION_CHECK": "1",
+        "PIP_NO_INPUT": "1",
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "PYTHONNOUSERSITE": "1",
+        "PIP_CACHE_DIR": SHARED_PIP_CACHE,
+    }
 
+    # run the subprocess natively instead of parking a worker thread on a
+    # blocking wait for the whole tox run; on timeout the cancel scope also
+    # takes care of killing the tox process itself
     try:
-        output = await trio.to_thread.run_sync(
-            partial(
-                subprocess.check_output,
+        with trio.fail_after(TOX_TIMEOUT):
+            completed = await trio.run_process(
                 args,
+                capture_stdout=True,
                 stderr=subprocess.STDOUT,
                 cwd=directory,
-                encoding="UTF-8",
-            ),
-            cancellable=True,
-        )
-    except subprocess.CalledProcessError as e:
-        result = e.returncode
-        output = e.output
-    else:
-        result = 0
-
-    return result, output
-
+                env=env,
+                check=False,
+            )
+    except trio.TooSlowError:
+        return 1, "tox run timed out"
+
+    return completed.returncode, completed.stdout.decode("UTF-8", errors="replace")
+
+
+# maximum time a single tox run may take, in seconds; enforced by a cancel
+# scope around run_process, which also kills the tox process on expiration
+TOX_TIMEOUT = 5 * 60
+
+# argv skeleton of the tox invocation; copied and filled in per call instead
+# of formatting and splitting a command line for every package
+TOX_ARGV_TEMPLATE = (
+    "tox",
+    "--result-json=result.json",
+    "-e",
+    None,
+    "--force-dep",
+    None,
+    "--workdir",
+    None,
+)
 
 # tox.ini contents when downloaded package does not have a tox.ini file
 # in this case we only display help information
@@ -148,7 +322,9 @@ deps = pytest
 commands = pytest --trace-config --help
 """
 
-PLACEHOLDER_TOX_BDIST = """\
+# parsed once at import instead of running the str.format parser per wheel
+PLACEHOLDER_TOX_BDIST = Template(
+    """\
 [tox]
 skipsdist = True
 
@@ -157,14 +333,62 @@ deps =
     pytest
     pip
 commands =
-    pip install ../{wheel_fname}
+    pip install $wheel_fname
     pytest --trace-config --help
 """
+)
 
 
 def read_plugins_index(file_name):
-    with open(file_name) as f:
-        return json.load(f)
+    with open(file_name, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def read_done_log(file_name):
+    """
+    Returns the set of (name, version, env, pytest) tuples handled by previous
+    interrupted invocations, or an empty set when starting fresh.
+    """
+    done = set()
+    try:
+        with open(file_name) as f:
+            for line in f:
+                entry = json.loads(line)
+                done.add((entry["name"], entry["version"], entry["env"], entry["pytest"]))
+    except OSError:
+        pass
+    return done
+
+
+def append_done_log(file_name, package_result, tox_env, pytest_version):
+    """
+    Records that the given package was handled; called from the trio task
+    which completed it, so appends never interleave.
+    """
+    entry = {
+        "name": package_result.name,
+        "version": package_result.version,
+        "env": tox_env,
+        "pytest": pytest_version,
+    }
+    with open(file_name, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def append_done_log_batch(file_name, results):
+    """
+    Records a successfully posted batch; the result payloads already carry
+    the name/version/env/pytest keys the log stores.
+    """
+    with open(file_name, "a") as f:
+        for result in results:
+            entry = {
+                "name": result["name"],
+                "version": result["version"],
+                "env": result["env"],
+                "pytest": result["pytest"],
+            }
+            f.write(json.dumps(entry) + "\n")
 
 
 PackageResult = namedtuple(
@@ -188,12 +412,88 @@ class ProgressCounter:
         return self._current * 100 // self._total
 
 
+@attr.s
+class StatusPrinter:
+    """
+    Collects per-package status lines and flushes them to stdout in periodic
+    batches, so workers finishing at the same time produce a single write
+    instead of contending on per-line prints (noticeable on line-buffered CI
+    logs with many workers).
+    """
+
+    _lines: List[str] = attr.ib(init=False, factory=list)
+    _cancel_scope: Optional[trio.CancelScope] = attr.ib(init=False, default=None)
+
+    def queue(self, line):
+        self._lines.append(line + "\n")
+
+    def flush(self):
+        if self._lines:
+            sys.stdout.write("".join(self._lines))
+            self._lines.clear()
+            sys.stdout.flush()
+
+    async def run(self):
+        """Flushes queued lines once per second until stop() is called."""
+        with trio.CancelScope() as self._cancel_scope:
+            while True:
+                await trio.sleep(1)
+                self.flush()
+        # one final flush so no queued lines are lost on the way out
+        self.flush()
+
+    def stop(self):
+        self._cancel_scope.cancel()
+
+
+# tox outputs larger than this are spooled to disk while their result waits
+# in the post queue; failing plugins can easily produce megabytes of output
+OUTPUT_SPOOL_THRESHOLD = 64 * 1024
+
+# only the tail of the output is posted; tox logs are tail-dominated (the
+# error and summary come last), and nobody scrolls through megabytes of
+# pip install noise on the site anyway
+OUTPUT_TAIL_LIMIT = 256 * 1024
+
+
+@attr.s
+class SpooledOutput:
+    """
+    Large tox output spooled to a gzipped temporary file while its result
+    waits to be posted, so it doesn't sit in the Python heap until the batch
+    goes out.
+    """
+
+    path: str = attr.ib()
+
+    @classmethod
+    def spool(cls, output):
+        fd, path = mkstemp(prefix="plugincompat-output-", suffix=".txt.gz")
+        os.close(fd)
+        # level 1 favors speed; tox logs are redundant enough that it still
+        # shrinks them roughly tenfold
+        with gzip.open(path, "wt", encoding="UTF-8", compresslevel=1) as f:
+            f.write(output)
+        return cls(path)
+
+    def read(self):
+        """Reads the output back and removes the spool file."""
+        with gzip.open(self.path, "rt", encoding="UTF-8") as f:
+            output = f.read()
+        os.unlink(self.path)
+        return output
+
+
 @attr.s
 class ResultsPoster:
     """
     Posts results of running the 'tox' command of a package back to the plugin compat site.
 
     It will post results in batches of ``post_chunks``.
+
+    When a ``nursery`` is given, full batches are posted in a background task
+    so the upload latency overlaps with the remaining tox runs instead of
+    blocking the worker which completed the batch.
     """
 
     session: asks.Session = attr.ib()
@@ -201,7 +501,9 @@ class ResultsPoster:
     tox_env: str = attr.ib()
     pytest_version: str = attr.ib()
     secret: Optional[str] = attr.ib()
-    _package_results: List[PackageResult] = attr.ib(init=False, factory=list)
+    post_url: Optional[str] = attr.ib(default=None)
+    nursery: Optional[trio.Nursery] = attr.ib(default=None)
+    _package_results: List[dict] = attr.ib(init=False, factory=list)
     _total_posted: int = attr.ib(init=False, default=0)
 
     @property
@@ -211,115 +513,169 @@ class ResultsPoster:
     async def maybe_post_batch(self, package_result):
         if package_result.status == "SKIPPED":
             return
-        self._package_results.append(package_result)
-        if len(self._package_results) >= self.batch_size:
-            await self.post_all()
-
-    async def post_all(self):
-        results = [
+        output = package_result.output
+        if len(output) > OUTPUT_TAIL_LIMIT:
+            output = "(output truncated)\n" + output[-OUTPUT_TAIL_LIMIT:]
+        if len(output) > OUTPUT_SPOOL_THRESHOLD:
+            output = SpooledOutput.spool(output)
+        # build the payload entry right away; batches are posted in
+        # completion order, there is no need to sort them first
+        self._package_results.append(
             {
                 "name": package_result.name,
                 "version": package_result.version,
                 "env": self.tox_env,
                 "pytest": self.pytest_version,
                 "status": "ok" if package_result.status_code == 0 else "fail",
-                "output": package_result.output,
+                "output": output,
                 "description": package_result.description,
             }
-            for package_result in sorted(self._package_results)
-        ]
-        self._package_results.clear()
+        )
+        if len(self._package_results) >= self.batch_size:
+            if self.nursery is not None:
+                self.nursery.start_soon(self._post_batch, self._take_batch())
+            else:
+                await self.post_all()
 
+    async def post_all(self):
+        await self._post_batch(self._take_batch())
+
+    def _take_batch(self):
+        results = self._package_results
+        self._package_results = []
+        for result in results:
+            if isinstance(result["output"], SpooledOutput):
+                result["output"] = result["output"].read()
+        return results
+
+    async def _post_batch(self, results):
         if self.secret:
-            post_url = os.environ["PLUGINCOMPAT_SITE"]
             data = {"secret": self.secret, "results": results}
-            headers = {"content-type": "application/json"}
-            response = await self.session.post(post_url, data=json.dumps(data), headers=headers)
+            # tox outputs are large and repetitive, so compressing the body
+            # cuts the bytes on the wire by an order of magnitude
+            body = gzip.compress(orjson.dumps(data), compresslevel=6)
+            headers = {"content-type": "application/json", "content-encoding": "gzip"}
+            response = await self.session.post(self.post_url, data=body, headers=headers)
             response.raise_for_status()
             self._total_posted += len(results)
+            # only now that the batch reached the site do these packages
+            # count as handled for resume purposes; appending earlier would
+            # make an interrupted run skip unposted results forever
+            append_done_log_batch(DONE_LOG, results)
             print(Fore.GREEN + "Batch of {} posted".format(len(results)))
         else:
             msg = "Skipping posting batch of {} because secret is not available"
             print(Fore.YELLOW + msg.format(len(results)))
 
 
-async def run_package(session, tox_env, pytest_version, name, version, description):
-    def get_elapsed():
-        return time.time() - start
-
-    start = time.time()
+async def fetch_known_results(session, site_url, tox_env, pytest_version):
+    """
+    Fetches the set of "name-version" packages which already have results on
+    the plugincompat site for this environment, in a single request.
 
-    # if we already have results, skip testing this plugin
-    url = os.environ.get("PLUGINCOMPAT_SITE")
-    if url:
+    Returns an empty set if the site is not configured or unreachable, in
+    which case all packages are processed normally.
+    """
+    if site_url:
         params = dict(py=tox_env, pytest=pytest_version)
         try:
-            response = await session.get(
-                "{}/output/{}-{}".format(url, name, version), params=params
-            )
+            response = await session.get("{}/known".format(site_url), params=params)
             if response.status_code == 200:
-                return PackageResult(
-                    name, version, 0, "SKIPPED", "Skipped", description, get_elapsed()
-                )
+                return frozenset(response.json()["data"])
         except Exception:
             pass
+    return frozenset()
+
 
-    client = RateLimitedProxy("https://pypi.org/pypi")
-    basename = await download_package(client, session, name, version)
-    if basename is None:
+async def run_package(cache, session, known, tox_env, pytest_version, name, version, description):
+    def get_elapsed():
+        return time.time() - start
+
+    start = time.time()
+
+    # if we already have results, skip testing this plugin
+    if "{}-{}".format(name, version) in known:
+        return PackageResult(name, version, 0, "SKIPPED", "Skipped", description, get_elapsed())
+
+    downloaded = await download_package(cache, session, name, version)
+    if downloaded is None:
         status_code, output = 1, "No source or compatible distribution found"
         return PackageResult(
             name, version, status_code, "NO DIST", output, description, get_elapsed()
         )
-    if basename.endswith(".whl"):
-        target = basename
-        mode = "bdist_wheel"
-    else:
-        target = extract(basename)
-        mode = "sdist"
+    basename, contents = downloaded
+    # each package works in its own directory so concurrent tasks never
+    # clobber each other's files, and the space is reclaimed right away
+    workdir = mkdtemp(prefix="{}-".format(name), dir=".")
+    try:
+        if basename.endswith(".whl"):
+            # wheels are installed by the generated tox.ini, so they do need
+            # to exist on disk
+            target = os.path.join(workdir, basename)
+            await trio.Path(target).write_bytes(contents)
+            mode = "bdist_wheel"
+            has_tox = False
+        else:
+            target, has_tox = extract(basename, BytesIO(contents), workdir)
+            mode = "sdist"
 
-    with trio.move_on_after(5 * 60) as scope:
         try:
-            status_code, output = await run_tox(target, tox_env, pytest_version, mode)
+            status_code, output = await run_tox(target, tox_env, pytest_version, mode, has_tox)
         except Exception:
             stream = StringIO()
             traceback.print_exc(file=stream)
             status_code, output = 1, "traceback:\n%s" % stream.getvalue()
-
-    if scope.cancelled_caught:
-        status_code, output = 1, "tox run timed out"
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
 
     output += "\n\nTime: %.1f seconds" % get_elapsed()
     status = "PASSED" if status_code == 0 else "FAILED"
     return PackageResult(name, version, status_code, status, output, description, get_elapsed())
 
 
-def print_package_result(progress_counter: ProgressCounter, package_result):
-    status_color_map = {
-        "SKIPPED": Fore.YELLOW,
-        "NO DIST": Fore.MAGENTA,
-        "PASSED": Fore.GREEN,
-        "FAILED": Fore.RED,
-    }
+# name of the Fore attribute used to colorize each status; resolved at print
+# time so color stripping configured in colorama still applies
+STATUS_COLOR_MAP = {
+    "SKIPPED": "YELLOW",
+    "NO DIST": "MAGENTA",
+    "PASSED": "GREEN",
+    "FAILED": "RED",
+}
+
+# row printed for each processed package; hoisted so the format spec is not
+# reparsed on every call
+RESULT_ROW = (
+    "{package:<60s} {status_color}{status:>15s}{elapsed_color}{elapsed:>6.1f}s "
+    "{percent_color}[%{percent:>3d}]"
+)
+
+
+def print_package_result(
+    status_printer: StatusPrinter, progress_counter: ProgressCounter, package_result
+):
     package = "{}-{}".format(package_result.name, package_result.version)
-    print(
-        "{package:<60s} {status_color}{package_result.status:>15s}"
-        "{elapsed_color}{package_result.elapsed:>6.1f}s "
-        "{percent_color}[%{percent:>3d}]".format(
-            package=package,
-            status_color=status_color_map[package_result.status],
-            package_result=package_result,
-            elapsed_color=Fore.CYAN,
-            percent_color=Fore.LIGHTCYAN_EX,
-            percent=progress_counter.increment_percentage(),
+    status_printer.queue(
+        RESULT_ROW.format_map(
+            dict(
+                package=package,
+                status_color=getattr(Fore, STATUS_COLOR_MAP[package_result.status]),
+                status=package_result.status,
+                elapsed_color=Fore.CYAN,
+                elapsed=package_result.elapsed,
+                percent_color=Fore.LIGHTCYAN_EX,
+                percent=progress_counter.increment_percentage(),
+            )
         )
     )
 
 
 async def process_package(
     semaphore,
+    cache,
     session,
+    known,
     results_poster: ResultsPoster,
+    status_printer: StatusPrinter,
     progress_counter: ProgressCounter,
     tox_env,
     pytest_version,
@@ -332,10 +688,14 @@ async def process_package(
     async with semaphore:
         task_status.started()
         package_result = await run_package(
-            session, tox_env, pytest_version, name, version, description
+            cache, session, known, tox_env, pytest_version, name, version, description
         )
-        print_package_result(progress_counter, package_result)
+        print_package_result(status_printer, progress_counter, package_result)
         await results_poster.maybe_post_batch(package_result)
+        if package_result.status == "SKIPPED":
+            # skipped packages never enter a batch; the others are logged by
+            # the poster once their batch has actually been posted
+            append_done_log(DONE_LOG, package_result, tox_env, pytest_version)
 
 
 async def main():
@@ -344,7 +704,7 @@ async def main():
     parser = ArgumentParser()
     parser.add_argument("--limit", type=int)
     parser.add_argument("--workers", type=int, default=8)
-    parser.add_argument("--post-batches", type=int, default=10)
+    parser.add_argument("--post-batches", type=int, default=50)
 
     args = parser.parse_args()
     limit = args.limit
@@ -352,16 +712,29 @@ async def main():
 
     pytest_version = os.environ["PYTEST_VERSION"]
 
+    # resolved once here instead of per batch/request down in the hot paths
+    site_url = os.environ.get("PLUGINCOMPAT_SITE")
+
     # important to remove POST_KEY from environment so others cannot sniff it somehow (#26)
     secret = os.environ.pop("POST_KEY", None)
     if secret is None and limit is None:
         # bail out early so CI doesn't take forever for a PR
-        limit = args.post_batches * 3
+        limit = 30
         print(Fore.CYAN + "Limit forced to {} since secret is unavailable".format(limit))
 
     tox_env = "py%d%d" % sys.version_info[:2]
 
     plugins = read_plugins_index(update_index.INDEX_FILE_NAME)
+
+    done = read_done_log(DONE_LOG)
+    if done:
+        before = len(plugins)
+        plugins = [
+            p for p in plugins if (p["name"], p["version"], tox_env, pytest_version) not in done
+        ]
+        msg = "Resuming: {} packages already handled by a previous run"
+        print(Fore.YELLOW + msg.format(before - len(plugins)))
+
     if limit is not None:
         plugins = plugins[:limit]
 
@@ -369,33 +742,48 @@ async def main():
     print(Fore.CYAN + f"Processing {len(plugins)} packages with {args.workers} workers")
 
     tmp = mkdtemp()
-    async with asks.Session() as session:
-        results_poster = ResultsPoster(
-            session,
-            batch_size=post_batches,
-            tox_env=tox_env,
-            pytest_version=pytest_version,
-            secret=secret,
-        )
+    cache = MetadataCache(CACHE_DIR)
+    # asks defaults to a single pooled connection, which would serialize all
+    # HTTP traffic; give each worker its own connection instead
+    async with asks.Session(connections=args.workers) as session:
+        known = await fetch_known_results(session, site_url, tox_env, pytest_version)
         progress_counter = ProgressCounter(n_total)
+        status_printer = StatusPrinter()
         semaphore = trio.Semaphore(args.workers)
         with working_directory(tmp):
-            async with trio.open_nursery() as nursery:
-                for plugin in plugins:
-                    await nursery.start(
-                        process_package,
-                        semaphore,
-                        session,
-                        results_poster,
-                        progress_counter,
-                        tox_env,
-                        pytest_version,
-                        plugin["name"],
-                        plugin["version"],
-                        plugin["description"],
-                    )
-
-        await results_poster.post_all()
+            # the outer nursery posts completed batches in the background
+            # while the inner one runs the packages themselves
+            async with trio.open_nursery() as poster_nursery:
+                poster_nursery.start_soon(status_printer.run)
+                results_poster = ResultsPoster(
+                    session,
+                    batch_size=post_batches,
+                    tox_env=tox_env,
+                    pytest_version=pytest_version,
+                    secret=secret,
+                    post_url=site_url,
+                    nursery=poster_nursery,
+                )
+                async with trio.open_nursery() as nursery:
+                    for plugin in plugins:
+                        await nursery.start(
+                            process_package,
+                            semaphore,
+                            cache,
+                            session,
+                            known,
+                            results_poster,
+                            status_printer,
+                            progress_counter,
+                            tox_env,
+                            pytest_version,
+                            plugin["name"],
+                            plugin["version"],
+                            plugin["description"],
+                        )
+
+                await results_poster.post_all()
+                status_printer.stop()
 
         print()
         if results_poster.total_posted:
@@ -1,19 +1,20 @@
+import gzip
 import json
 import os
 import sys
 import zipfile
-from pathlib import Path
-from shutil import copy
+from io import BytesIO
 from textwrap import dedent
+from unittest import mock
 
-import asynctest
-import distlib
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
 
 import run
 from run import download_package
 from run import extract
 from run import main
+from run import MetadataCache
 from run import PackageResult
 from run import read_plugins_index
 
@@ -47,37 +48,149 @@ commands = python -c "print('hi from tox')"
 """
 
 
-@pytest.fixture(autouse=True)
-def patch_env(monkeypatch):
-    monkeypatch.setenv("PYTEST_VERSION", "1.2.3")
-    monkeypatch.setenv("PLUGINCOMPAT_SITE", "http://plugincompat.example.com")
+# computed once at import instead of re-running dedent per test run
+EXPECTED_MAIN_OUTPUT = dedent(
+    """\
+    Processing 2 packages with 1 workers
+    pytest-plugin-a-0.1.1                                                 PASSED   0.0s [% 50]
+    pytest-plugin-b-0.2.2                                                 PASSED   0.0s [%100]
+
+    Posted 2 new results
+    All done, congratulations :)
+    """
+)
+
+EXPECTED_POSTED_PAYLOAD = {
+    "results": [
+        {
+            "description": "the description 1",
+            "env": "py38",
+            "name": "pytest-plugin-a",
+            "output": "whatever 1",
+            "pytest": "3.5.2",
+            "status": "ok",
+            "version": "0.1.1",
+        },
+        {
+            "description": "the description 2",
+            "env": "py38",
+            "name": "pytest-plugin-b",
+            "output": "whatever 2",
+            "pytest": "3.5.2",
+            "status": "fail",
+            "version": "0.2.2",
+        },
+    ],
+    "secret": "ILIKETURTLES",
+}
 
+# release metadata fed to download_package; shared module-level constants so
+# each test (and each call within a test) reuses the same objects
+SDIST_URLS = [
+    {
+        "filename": "whatever.tar.gz",
+        "url": "/path/to/whatever.tar.gz",
+        "packagetype": "sdist",
+    }
+]
 
-@pytest.fixture(autouse=True)
-def fake_index_json(monkeypatch):
+WHL_URLS = [
+    {
+        "filename": "myplugin-1.0.0-py2.py3-none-any.whl",
+        "url": "/path/to/myplugin-1.0.0-py2.py3-none-any.whl",
+        "packagetype": "bdist_wheel",
+    }
+]
+
+
+def build_zip_bytes(files):
+    """Returns the bytes of a zip archive with the given {name: text} members."""
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, mode="w") as z:
+        for name, content in files.items():
+            z.writestr(name, content)
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="session")
+def empty_setup_zip_bytes():
+    """myplugin sdist whose setup.py is empty, making tox error out."""
+    return build_zip_bytes({"myplugin/setup.py": ""})
+
+
+@pytest.fixture(scope="session")
+def empty_zipfile_bytes():
+    """zip archive with no members at all, making the tox invocation crash."""
+    return b"PK\x05\x06" + b"\x00" * 18
+
+
+@pytest.fixture(scope="session")
+def myplugin_zip_bytes():
+    """well-formed myplugin sdist shipping its own tox.ini."""
+    return build_zip_bytes(
+        {
+            "myplugin/setup.py": (
+                "from distutils.core import setup\nsetup(name='myplugin', version='1.0')"
+            ),
+            "myplugin/tox.ini": canned_tox_ini,
+        }
+    )
+
+
+# none of the tests depend on varying these, so patch them once per module
+# instead of paying a patch/restore cycle per test; MonkeyPatch is
+# instantiated directly because the plain monkeypatch fixture is
+# function-scoped and pytest.MonkeyPatch only became public in pytest 6.2
+@pytest.fixture(autouse=True, scope="module")
+def patch_env():
+    mp = MonkeyPatch()
+    mp.setenv("PYTEST_VERSION", "1.2.3")
+    mp.setenv("PLUGINCOMPAT_SITE", "http://plugincompat.example.com")
+    # run.py is imported before fixtures run, so setting the env var
+    # alone is not enough to disable color: swap in the stub directly
+    mp.setenv("PLUGINCOMPAT_NO_COLOR", "1")
+    mp.setattr("run.Fore", run._NullFore)
+    yield
+    mp.undo()
+
+
+@pytest.fixture(autouse=True, scope="module")
+def fake_index_json():
     canned_data = [
         {"description": "the description 1", "name": "pytest-plugin-a", "version": "0.1.1"},
         {"description": "the description 2", "name": "pytest-plugin-b", "version": "0.2.2"},
         {"description": "the description 3", "name": "pytest-plugin-c", "version": "0.3.3"},
     ]
-    monkeypatch.setattr("run.read_plugins_index", lambda file_name: canned_data)
+    mp = MonkeyPatch()
+    mp.setattr("run.read_plugins_index", lambda file_name: canned_data)
+    yield
+    mp.undo()
 
 
 @pytest.fixture(autouse=True)
-def freeze_time(monkeypatch):
-    monkeypatch.setattr("time.time", lambda: 1535608108.637679)
+def isolated_done_log(tmp_path, monkeypatch):
+    monkeypatch.setattr("run.DONE_LOG", str(tmp_path / "done.jsonl"))
 
 
 @pytest.fixture(autouse=True)
-def greyorama(monkeypatch):
-    class Fore:
-        def __getattr__(self, name):
-            return ""
+def isolated_shared_dirs(tmp_path, monkeypatch):
+    """Keep the persistent tox workdir and pip cache out of the real /tmp:
+    leftovers from one run would change tox's behavior in the next."""
+    monkeypatch.setattr("run.SHARED_TOX_WORKDIR", str(tmp_path / "toxwork"))
+    monkeypatch.setattr("run.SHARED_PIP_CACHE", str(tmp_path / "pip-cache"))
+
 
-    monkeypatch.setattr("run.Fore", Fore())
+@pytest.fixture(autouse=True, scope="module")
+def freeze_time():
+    mp = MonkeyPatch()
+    mp.setattr("time.time", lambda: 1535608108.637679)
+    yield
+    mp.undo()
 
 
-async def fake_run_package(session, tox_env, pytest_version, name, version, description):
+async def fake_run_package(
+    cache, session, known, tox_env, pytest_version, name, version, description
+):
     result = PackageResult(
         name=name,
         version=version,
@@ -92,12 +205,39 @@ async def fake_run_package(session, tox_env, pytest_version, name, version, desc
 
 @pytest.fixture(name="mock_session")
 def mock_session_():
-    session = asynctest.MagicMock()
-    session.post = asynctest.CoroutineMock()
-    session.get = asynctest.CoroutineMock()
+    session = mock.MagicMock()
+    # the response objects themselves are synchronous, only get/post are
+    session.post = mock.AsyncMock(return_value=mock.MagicMock())
+    session.get = mock.AsyncMock()
     return session
 
 
+class RecordingSession:
+    """
+    Bare-bones stand-in for asks.Session which records post calls without
+    MagicMock's per-call bookkeeping.
+    """
+
+    def __init__(self):
+        self.posts = []
+
+    async def post(self, url, data=None, headers=None):
+        self.posts.append((url, data, headers))
+        return mock.MagicMock()
+
+
+@pytest.fixture(name="metadata_cache")
+def metadata_cache_(tmp_path):
+    return MetadataCache(str(tmp_path / "pypi-cache"))
+
+
+def make_json_response(payload):
+    response = mock.MagicMock()
+    response.status_code = 200
+    response.json = lambda: payload
+    return response
+
+
 async def test_main(monkeypatch, capsys):
     collected = []
 
@@ -115,7 +255,11 @@ async def test_main(monkeypatch, capsys):
         def total_posted(self):
             return len(collected)
 
+    async def fake_fetch_known_results(session, site_url, tox_env, pytest_version):
+        return frozenset()
+
     monkeypatch.setattr("run.ResultsPoster", FakeResultsPoster)
+    monkeypatch.setattr("run.fetch_known_results", fake_fetch_known_results)
     monkeypatch.setattr("run.run_package", fake_run_package)
     monkeypatch.setattr("sys.argv", ["run.py", "--limit=2", "--workers=1"])
     monkeypatch.setattr("colorama.init", lambda autoreset, strip: None)
@@ -123,16 +267,7 @@ async def test_main(monkeypatch, capsys):
     await main()
     out, err = capsys.readouterr()
     assert err == ""
-    assert out == dedent(
-        """\
-        Processing 2 packages with 1 workers
-        pytest-plugin-a-0.1.1                                                 PASSED   0.0s [% 50]
-        pytest-plugin-b-0.2.2                                                 PASSED   0.0s [%100]
-
-        Posted 2 new results
-        All done, congratulations :)
-        """
-    )
+    assert out == EXPECTED_MAIN_OUTPUT
     assert collected == [
         PackageResult(
             name="pytest-plugin-a",
@@ -155,71 +290,112 @@ async def test_main(monkeypatch, capsys):
     ]
 
 
-async def test_post_test_results(capsys, mock_session):
+async def test_post_test_results(capsys, monkeypatch):
+    # capture the payload at the orjson.dumps boundary so the assertion
+    # compares dicts directly instead of round-tripping through bytes
+    captured = []
+    orig_dumps = run.orjson.dumps
+
+    def capturing_dumps(obj, *args, **kwargs):
+        captured.append(obj)
+        return orig_dumps(obj, *args, **kwargs)
+
+    monkeypatch.setattr(run.orjson, "dumps", capturing_dumps)
 
+    session = RecordingSession()
     poster = run.ResultsPoster(
-        mock_session, batch_size=2, tox_env="py38", pytest_version="3.5.2", secret="ILIKETURTLES"
+        session,
+        batch_size=2,
+        tox_env="py38",
+        pytest_version="3.5.2",
+        secret="ILIKETURTLES",
+        post_url="http://plugincompat.example.com",
     )
     await poster.maybe_post_batch(packages_results["pytest-plugin-a"])
-    assert mock_session.post.call_count == 0  # not posted yet
+    assert session.posts == []  # not posted yet
 
     await poster.maybe_post_batch(packages_results["pytest-plugin-b"])
-    assert mock_session.post.call_count == 1
     out, err = capsys.readouterr()
     assert err == ""
     assert "Batch of 2 posted\n" in out
-    assert mock_session.post.call_count == 1
-    args, kwargs = mock_session.post.call_args
-    assert args[0] == "http://plugincompat.example.com"
-    assert json.loads(kwargs["data"]) == {
-        "results": [
-            {
-                "description": "the description 1",
-                "env": "py38",
-                "name": "pytest-plugin-a",
-                "output": "whatever 1",
-                "pytest": "3.5.2",
-                "status": "ok",
-                "version": "0.1.1",
-            },
-            {
-                "description": "the description 2",
-                "env": "py38",
-                "name": "pytest-plugin-b",
-                "output": "whatever 2",
-                "pytest": "3.5.2",
-                "status": "fail",
-                "version": "0.2.2",
-            },
-        ],
-        "secret": "ILIKETURTLES",
+    [(url, data, headers)] = session.posts
+    assert url == "http://plugincompat.example.com"
+    assert headers["content-encoding"] == "gzip"
+    assert captured == [EXPECTED_POSTED_PAYLOAD]
+    # the posted packages only count as done once the batch went through
+    assert run.read_done_log(run.DONE_LOG) == {
+        ("pytest-plugin-a", "0.1.1", "py38", "3.5.2"),
+        ("pytest-plugin-b", "0.2.2", "py38", "3.5.2"),
     }
 
 
-async def test_no_post_if_no_secret(capsys, mock_session):
+async def test_large_output_spooled_while_queued(capsys, mock_session):
+    poster = run.ResultsPoster(
+        mock_session,
+        batch_size=2,
+        tox_env="py38",
+        pytest_version="3.5.2",
+        secret="ILIKETURTLES",
+        post_url="http://plugincompat.example.com",
+    )
+    big_output = "x" * (run.OUTPUT_SPOOL_THRESHOLD + 1)
+    result = packages_results["pytest-plugin-a"]._replace(output=big_output)
+    await poster.maybe_post_batch(result)
+
+    spooled = poster._package_results[0]["output"]
+    assert isinstance(spooled, run.SpooledOutput)
+
+    await poster.maybe_post_batch(packages_results["pytest-plugin-b"])
+    args, kwargs = mock_session.post.call_args
+    posted = json.loads(gzip.decompress(kwargs["data"]))
+    assert posted["results"][0]["output"] == big_output
+    # the spool file is removed once the output is read back for posting
+    assert not os.path.exists(spooled.path)
+
+
+async def test_huge_output_truncated_to_tail(capsys, mock_session):
+    poster = run.ResultsPoster(
+        mock_session,
+        batch_size=1,
+        tox_env="py38",
+        pytest_version="3.5.2",
+        secret="ILIKETURTLES",
+        post_url="http://plugincompat.example.com",
+    )
+    huge_output = "head" + "x" * run.OUTPUT_TAIL_LIMIT
+    result = packages_results["pytest-plugin-a"]._replace(output=huge_output)
+    await poster.maybe_post_batch(result)
+
+    args, kwargs = mock_session.post.call_args
+    posted = json.loads(gzip.decompress(kwargs["data"]))
+    output = posted["results"][0]["output"]
+    assert output == "(output truncated)\n" + "x" * run.OUTPUT_TAIL_LIMIT
+
+
+async def test_no_post_if_no_secret(capsys):
+    session = RecordingSession()
     poster = run.ResultsPoster(
-        mock_session, batch_size=1, tox_env="py38", pytest_version="3.5.2", secret=None
+        session, batch_size=1, tox_env="py38", pytest_version="3.5.2", secret=None
     )
     await poster.maybe_post_batch(packages_results["pytest-plugin-a"])
     out, err = capsys.readouterr()
     assert err == ""
     assert "Skipping posting batch of 1 because secret is not available" in out
+    assert session.posts == []
 
 
-async def test_process_package_skips_if_result_already_on_plugincompat_website(mock_session):
-    mock_session.get.return_value.status_code = 200
+async def test_process_package_skips_if_result_already_known(mock_session, metadata_cache):
     result = await run.run_package(
+        cache=metadata_cache,
         session=mock_session,
+        known=frozenset({"myplugin-1.0"}),
         tox_env="py10",
         pytest_version="1.2.3",
         name="myplugin",
         version="1.0",
         description="'sup",
     )
-    assert mock_session.get.call_count == 1
-    args, kwargs = mock_session.get.call_args
-    assert args[0] == "http://plugincompat.example.com/output/myplugin-1.0"
-    assert kwargs["params"] == dict(py="py10", pytest="1.2.3")
+    assert mock_session.get.call_count == 0
     assert result == PackageResult(
         name="myplugin",
         version="1.0",
@@ -231,11 +407,12 @@ async def test_process_package_skips_if_result_already_on_plugincompat_website(m
     )
 
 
-async def test_process_package_no_dist_available(monkeypatch, mock_session):
-    mock_session.get.return_value.status_code = 404
-    with asynctest.patch("run.download_package", return_value=None, autospec=True):
+async def test_process_package_no_dist_available(monkeypatch, mock_session, metadata_cache):
+    with mock.patch("run.download_package", return_value=None, autospec=True):
         result = await run.run_package(
+            metadata_cache,
             mock_session,
+            frozenset(),
             tox_env="py10",
             pytest_version="1.2.3",
             name="myplugin",
@@ -243,10 +420,7 @@ async def test_process_package_no_dist_available(monkeypatch, mock_session):
             description="'sup",
         )
 
-    assert mock_session.get.call_count == 1
-    args, kwargs = mock_session.get.call_args
-    assert args[0] == "http://plugincompat.example.com/output/myplugin-1.0"
-    assert kwargs["params"] == dict(py="py10", pytest="1.2.3")
+    assert mock_session.get.call_count == 0
     assert result == PackageResult(
         name="myplugin",
         version="1.0",
@@ -258,135 +432,168 @@ async def test_process_package_no_dist_available(monkeypatch, mock_session):
     )
 
 
-async def test_process_package_tox_errored(tmpdir, monkeypatch, mock_session):
-    mock_session.get.return_value.status_code = 404
-    monkeypatch.chdir(tmpdir)
-
-    tmpdir.join("myplugin").ensure_dir()
-    tmpdir.join("myplugin").join("setup.py").ensure(file=True)
-    with zipfile.ZipFile(str(tmpdir / "myplugin.zip"), mode="w") as z:
-        z.write("myplugin")
-
-    with asynctest.patch("run.download_package", return_value="myplugin.zip", autospec=True):
-        result = await run.run_package(
-            mock_session,
-            tox_env="py36",
-            pytest_version="1.2.3",
-            name="myplugin",
-            version="1.0",
-            description="'sup",
-        )
-    assert result.name == "myplugin"
-    assert result.status_code == 1
-    assert result.status == "FAILED"
-    assert "ERROR: setup.py is empty" in result.output
-
-
-async def test_process_package_tox_crash(tmpdir, monkeypatch, mock_session):
-    mock_session.get.return_value.status_code = 404
-    monkeypatch.chdir(tmpdir)
-
-    empty_zipfile_bytes = b"PK\x05\x06" + b"\x00" * 18
-    tmpdir.join("myplugin.zip").write(empty_zipfile_bytes)
-
-    with asynctest.patch("run.download_package", return_value="myplugin.zip", autospec=True):
-        result = await run.run_package(
-            mock_session,
-            tox_env="py36",
-            pytest_version="1.2.3",
-            name="myplugin",
-            version="1.0",
-            description="'sup",
-        )
-    assert result.name == "myplugin"
-    assert result.status_code == 1
-    assert result.status == "FAILED"
-    assert result.output.startswith("traceback:\n")
-    fn = os.path.join("myplugin", "tox.ini")
-    assert "No such file or directory: {fn!r}".format(fn=fn) in result.output
-
-
-async def test_process_package_tox_succeeded(tmpdir, monkeypatch, mock_session):
-    py = "py{}{}".format(*sys.version_info[:2])
-    mock_session.get.return_value.status_code = 404
-
-    monkeypatch.chdir(tmpdir)
-    tmpdir.join("myplugin").ensure_dir()
-    tmpdir.join("myplugin").join("setup.py").write(
-        "from distutils.core import setup\nsetup(name='myplugin', version='1.0')"
-    )
-    tmpdir.join("myplugin").join("tox.ini").write(canned_tox_ini)
-    with zipfile.ZipFile(str(tmpdir / "myplugin.zip"), mode="w") as z:
-        z.write("myplugin")
-    with asynctest.patch("run.download_package", return_value="myplugin.zip", autospec=True):
+@pytest.mark.parametrize(
+    "zip_fixture, tox_env, pytest_version, expected_status_code, expected_status, needles",
+    [
+        pytest.param(
+            "empty_setup_zip_bytes",
+            "py36",
+            "1.2.3",
+            1,
+            "FAILED",
+            ["ERROR: setup.py is empty"],
+            id="tox_errored",
+        ),
+        pytest.param(
+            "empty_zipfile_bytes",
+            "py36",
+            "1.2.3",
+            1,
+            "FAILED",
+            # the exact tox.ini path includes the task's scratch directory,
+            # so only match the tail of it
+            ["traceback:\n", "No such file or directory", os.path.join("myplugin", "tox.ini")],
+            id="tox_crash",
+        ),
+        pytest.param(
+            "myplugin_zip_bytes",
+            "py{}{}".format(*sys.version_info[:2]),
+            "3.7.4",
+            0,
+            "PASSED",
+            ["hi from tox", "congratulations :)"],
+            id="tox_succeeded",
+        ),
+    ],
+)
+async def test_process_package_tox(
+    request,
+    tmp_path,
+    monkeypatch,
+    mock_session,
+    metadata_cache,
+    zip_fixture,
+    tox_env,
+    pytest_version,
+    expected_status_code,
+    expected_status,
+    needles,
+):
+    monkeypatch.chdir(tmp_path)
+
+    downloaded = ("myplugin.zip", request.getfixturevalue(zip_fixture))
+    with mock.patch("run.download_package", return_value=downloaded, autospec=True):
         result = await run.run_package(
+            metadata_cache,
             mock_session,
-            tox_env=py,
-            pytest_version="3.7.4",
+            frozenset(),
+            tox_env=tox_env,
+            pytest_version=pytest_version,
             name="myplugin",
             version="1.0",
             description="'sup",
         )
     assert result.name == "myplugin"
     assert result.version == "1.0"
-    assert result.status_code == 0
-    assert result.status == "PASSED"
+    assert result.status_code == expected_status_code
+    assert result.status == expected_status
     assert result.description == "'sup"
     assert result.elapsed == 0.0
-    assert "hi from tox" in result.output
-    assert "congratulations :)" in result.output
+    for needle in needles:
+        assert needle in result.output
 
 
 def test_unsupported_extraction_file_extension():
     with pytest.raises(Exception, match="could not extract myplugin.dat"):
-        extract("myplugin.dat")
+        extract("myplugin.dat", BytesIO(b""))
+
 
+def test_done_log(tmp_path):
+    log = str(tmp_path / "done.jsonl")
+    assert run.read_done_log(log) == set()
 
-def test_read_plugins(monkeypatch, tmpdir):
-    monkeypatch.chdir(tmpdir)
-    tmpdir.join("index.json").write('{"k":"v"}')
+    run.append_done_log(log, packages_results["pytest-plugin-a"], "py38", "3.5.2")
+    run.append_done_log(log, packages_results["pytest-plugin-b"], "py38", "3.5.2")
+    assert run.read_done_log(log) == {
+        ("pytest-plugin-a", "0.1.1", "py38", "3.5.2"),
+        ("pytest-plugin-b", "0.2.2", "py38", "3.5.2"),
+    }
+
+
+def test_read_plugins(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "index.json").write_text('{"k":"v"}')
     result = read_plugins_index(file_name="index.json")
     assert result == {"k": "v"}
 
 
-async def test_download_package(mock_session):
-    mock_session.get.return_value.content = expected_content = b"some contents"
-
-    class FakeClient:
-        def release_urls(self, name, version):
-            return [
-                {
-                    "filename": "whatever.tar.gz",
-                    "url": "/path/to/whatever.tar.gz",
-                    "packagetype": "sdist",
-                }
-            ]
+async def test_download_package(mock_session, metadata_cache):
+    content_response = mock.MagicMock()
+    content_response.content = expected_content = b"some contents"
+    mock_session.get.side_effect = [
+        make_json_response({"urls": SDIST_URLS}),
+        content_response,
+    ]
 
-    basename = await download_package(
-        client=FakeClient(), session=mock_session, name="whatever", version="1.0"
+    basename, contents = await download_package(
+        cache=metadata_cache, session=mock_session, name="whatever", version="1.0"
     )
+    assert mock_session.get.call_args_list[0][0][0] == "https://pypi.org/pypi/whatever/1.0/json"
     assert mock_session.get.call_args[0][0] == "/path/to/whatever.tar.gz"
     assert basename == "whatever.tar.gz"
-    assert Path(basename).read_bytes() == expected_content
+    assert contents == expected_content
+
+    # both the metadata and the archive are now cached on disk, so the
+    # second download needs no network at all
+    mock_session.get.reset_mock()
+    mock_session.get.side_effect = None
+    basename, contents = await download_package(
+        cache=metadata_cache, session=mock_session, name="whatever", version="1.0"
+    )
+    assert basename == "whatever.tar.gz"
+    assert contents == expected_content
+    assert mock_session.get.call_count == 0
 
 
-async def test_download_package_whl(monkeypatch, mocker, mock_session):
-    mock_session.get.return_value.content = b"some contents"
+async def test_fetch_known_results(mock_session):
+    mock_session.get.return_value = make_json_response({"data": ["myplugin-1.0"]})
+    known = await run.fetch_known_results(
+        mock_session, "http://plugincompat.example.com", "py38", "3.5.2"
+    )
+    args, kwargs = mock_session.get.call_args
+    assert args[0] == "http://plugincompat.example.com/known"
+    assert kwargs["params"] == dict(py="py38", pytest="3.5.2")
+    assert known == frozenset({"myplugin-1.0"})
 
-    m = mocker.patch.object(run, "is_compatible", autospec=True, return_value=True)
 
-    class FakeClient:
-        def release_urls(self, name, version):
-            return [
-                {
-                    "filename": "myplugin-1.0.0-py2.py3-none-any.whl",
-                    "url": "/path/to/myplugin-1.0.0-py2.py3-none-any.whl",
-                    "packagetype": "bdist_wheel",
-                }
-            ]
+async def test_fetch_known_results_unreachable(mock_session):
+    mock_session.get.side_effect = Exception("connection refused")
+    known = await run.fetch_known_results(
+        mock_session, "http://plugincompat.example.com", "py38", "3.5.2"
+    )
+    assert known == frozenset()
+
+
+async def test_download_package_no_metadata(mock_session, metadata_cache):
+    mock_session.get.return_value.status_code = 404
 
     basename = await download_package(
-        session=mock_session, client=FakeClient(), name="myplugin", version="1.0"
+        cache=metadata_cache, session=mock_session, name="whatever", version="1.0"
+    )
+    assert basename is None
+
+
+async def test_download_package_whl(monkeypatch, mocker, mock_session, metadata_cache):
+    content_response = mock.MagicMock()
+    content_response.content = b"some contents"
+    mock_session.get.side_effect = lambda url, **kwargs: (
+        make_json_response({"urls": WHL_URLS}) if url.endswith("/json") else content_response
+    )
+
+    m = mocker.patch.object(run, "is_compatible", autospec=True, return_value=True)
+
+    basename, contents = await download_package(
+        session=mock_session, cache=metadata_cache, name="myplugin", version="1.0"
     )
     assert basename == "myplugin-1.0.0-py2.py3-none-any.whl"
 
@@ -394,32 +601,34 @@ async def test_download_package_whl(monkeypatch, mocker, mock_session):
     m.return_value = False
     assert (
         await download_package(
-            session=mock_session, client=FakeClient(), name="myplugin", version="1.0"
+            session=mock_session, cache=metadata_cache, name="myplugin", version="1.0"
         )
         is None
     )
 
-    # invalid wheel
-    m.side_effect = distlib.DistlibException()
-    assert (
-        await download_package(
-            session=mock_session, client=FakeClient(), name="myplugin", version="1.0"
-        )
-        is None
-    )
+
+def test_is_compatible():
+    assert run.is_compatible("myplugin-1.0.0-py2.py3-none-any.whl")
+    # python 2 only wheel
+    assert not run.is_compatible("myplugin-1.0.0-py2-none-any.whl")
+    # invalid wheel filename
+    assert not run.is_compatible("invalid.whl")
 
 
-async def test_process_package_tox_succeeded_bdist(datadir, monkeypatch, mock_session):
+async def test_process_package_tox_succeeded_bdist(
+    datadir, monkeypatch, mock_session, metadata_cache
+):
     py = "py{}{}".format(*sys.version_info[:2])
-    mock_session.get.return_value.status_code = 404
 
     monkeypatch.chdir(datadir)
 
-    with asynctest.patch(
-        "run.download_package", return_value="myplugin-1.0.0-py2.py3-none-any.whl", autospec=True
-    ):
+    wheel_fname = "myplugin-1.0.0-py2.py3-none-any.whl"
+    downloaded = (wheel_fname, (datadir / wheel_fname).read_bytes())
+    with mock.patch("run.download_package", return_value=downloaded, autospec=True):
         result = await run.run_package(
+            cache=metadata_cache,
             session=mock_session,
+            known=frozenset(),
             tox_env=py,
             pytest_version="3.7.4",
             name="myplugin",
@@ -1,15 +1,52 @@
+from types import SimpleNamespace
+
+import pytest
+
 import update_index
 
 
-def test_iter_plugins(mocker):
-    client = mocker.MagicMock()
-    client.list_packages.return_value = ["pytest-plugin-a", "pytest-plugin-b"]
-    client.package_releases.return_value = ["1.0"]
-    client.browse.return_value = [("pytest-plugin-c", "2.0")]
-    client.release_data = lambda name, version: dict(name=name, version=version, summary="")
+def make_fake_session(projects):
+    # plain SimpleNamespace stubs: no MagicMock child lookup or call
+    # recording on the per-plugin request path
+    def fake_get(url, **kwargs):
+        if url.endswith("/simple/"):
+            payload = {"projects": [{"name": name} for name in projects]}
+        else:
+            name = url.rsplit("/", 2)[-2]
+            payload = {"info": {"name": name, "version": "1.0", "summary": ""}}
+        return SimpleNamespace(
+            status_code=200,
+            json=lambda payload=payload: payload,
+            raise_for_status=lambda: None,
+        )
+
+    return SimpleNamespace(get=fake_get)
+
 
-    results = update_index.iter_plugins(client, {"pytest-plugin-a"})
-    assert list(results) == [("pytest-plugin-b", "1.0", ""), ("pytest-plugin-c", "2.0", "")]
+@pytest.mark.parametrize(
+    "projects, browse, expected",
+    [
+        pytest.param(
+            ["pytest-plugin-a", "pytest-plugin-b", "some-other-lib"],
+            None,
+            [("pytest-plugin-b", "1.0", "")],
+            id="simple_only",
+        ),
+        pytest.param(
+            ["pytest-plugin-a", "pytest-plugin-b"],
+            [("pytest-plugin-c", "2.0"), ("", "")],
+            [("pytest-plugin-b", "1.0", ""), ("pytest-plugin-c", "1.0", "")],
+            id="with_classifier",
+        ),
+    ],
+)
+def test_iter_plugins(projects, browse, expected):
+    session = make_fake_session(projects)
+    classifier_client = None
+    if browse is not None:
+        classifier_client = SimpleNamespace(browse=lambda classifiers: browse)
 
-    results = update_index.iter_plugins(client, {"pytest-plugin-a"}, consider_classifier=False)
-    assert list(results) == [("pytest-plugin-b", "1.0", "")]
+    results = update_index.iter_plugins(
+        session, {"pytest-plugin-a"}, classifier_client=classifier_client
+    )
+    assert list(results) == expected
@@ -1,4 +1,7 @@
+import functools
+import gzip
 import os
+from operator import itemgetter
 from unittest import mock
 
 import pytest
@@ -13,22 +16,35 @@ from web import get_python_versions
 from web import PlugsStorage
 
 
-@pytest.fixture
-def storage():
+@pytest.fixture(scope="session")
+def _storage_instance():
+    """One engine and schema for the whole session; tests share it through
+    the storage fixture below, which wipes the tables between tests."""
     with PlugsStorage("sqlite:///:memory:") as st:
         yield st
 
 
+@pytest.fixture
+def storage(_storage_instance):
+    yield _storage_instance
+    _storage_instance.drop_all()
+
+
+# base payload built once; make_result_payload copies it instead of
+# re-evaluating the dict literal on every call
+_RESULT_TEMPLATE = {
+    "name": "mylib",
+    "version": "1.0",
+    "env": "py27",
+    "pytest": "2.3",
+    "status": "ok",
+    "output": "all commands:\nok",
+    "description": "a generic library",
+}
+
+
 def make_result_payload(**kwparams):
-    result = {
-        "name": "mylib",
-        "version": "1.0",
-        "env": "py27",
-        "pytest": "2.3",
-        "status": "ok",
-        "output": "all commands:\nok",
-        "description": "a generic library",
-    }
+    result = _RESULT_TEMPLATE.copy()
     result.update(kwparams)
     return result
 
@@ -43,7 +59,7 @@ class TestPlugsStorage:
         """
         :type storage: PlugsStorage
         """
-        assert list(storage.get_all_results()) == []
+        assert storage.get_all_results() == []
 
         with pytest.raises(TypeError):
             # missing "env" key
@@ -72,19 +88,34 @@ class TestPlugsStorage:
         assert storage.get_test_results("foobar", "1.0") == []
 
     def test_get_all_results(self, storage):
-        assert list(storage.get_all_results()) == []
+        assert storage.get_all_results() == []
 
         result1 = make_result_payload()
         storage.add_test_result(result1)
-        assert list(storage.get_all_results()) == [result1]
+        assert storage.get_all_results() == [result1]
 
         result2 = make_result_payload(version="1.1")
         storage.add_test_result(result2)
-        assert list(storage.get_all_results()) == [result1, result2]
+        assert storage.get_all_results() == [result1, result2]
 
         result3 = make_result_payload(name="myotherlib")
         storage.add_test_result(result3)
-        assert list(storage.get_all_results()) == [result1, result2, result3]
+        assert storage.get_all_results() == [result1, result2, result3]
+
+    def test_get_tested_packages(self, storage):
+        storage.add_test_result(make_result_payload())
+        storage.add_test_result(make_result_payload(version="1.1"))
+        storage.add_test_result(make_result_payload(name="myotherlib"))
+        storage.add_test_result(make_result_payload(env="py33"))
+        storage.add_test_result(make_result_payload(pytest="2.4"))
+
+        assert storage.get_tested_packages("py27", "2.3") == [
+            "mylib-1.0",
+            "mylib-1.1",
+            "myotherlib-1.0",
+        ]
+        assert storage.get_tested_packages("py33", "2.3") == ["mylib-1.0"]
+        assert storage.get_tested_packages("py34", "2.3") == []
 
     def test_drop_all(self, storage):
         result1 = make_result_payload()
@@ -97,6 +128,61 @@ class TestPlugsStorage:
         assert len(storage.get_all_results()) == 0
 
 
+@pytest.fixture(scope="module")
+def render_namespace_data():
+    """
+    Input results for get_namespace_for_rendering plus the expected
+    namespace; built once per module since the test never mutates them.
+    Only the latest lib versions should be rendered.
+    """
+    all_results = [
+        make_result_payload(),
+        make_result_payload(env="py26", status="failed"),
+        make_result_payload(env="py32", status="failed"),
+        make_result_payload(env="py33", status="failed"),
+        make_result_payload(name="myotherlib", version="1.8", pytest="2.4"),
+        make_result_payload(env="py33", pytest="2.4"),
+        make_result_payload(env="py33", pytest="2.4", version="0.6"),
+        make_result_payload(env="py33", pytest="2.4", version="0.7"),
+        make_result_payload(env="py33", pytest="2.4", version="0.8"),
+        make_result_payload(
+            name="myotherlib",
+            version="2.0",
+            pytest="2.4",
+            description="my other library",
+            output="output for myotherlib-2.0",
+        ),
+    ]
+
+    bad_result = make_result_payload(name="badlib")
+    del bad_result["output"]
+    all_results.append(bad_result)
+
+    output_ok = "all commands:\nok"
+    lib_data = {
+        ("badlib-1.0", "py27", "2.3"): ("ok", "<no output available>", "a generic library"),
+        ("mylib-1.0", "py27", "2.3"): ("ok", output_ok, "a generic library"),
+        ("mylib-1.0", "py33", "2.3"): ("failed", output_ok, "a generic library"),
+        ("mylib-1.0", "py33", "2.4"): ("ok", output_ok, "a generic library"),
+        ("myotherlib-2.0", "py27", "2.4"): (
+            "ok",
+            "output for myotherlib-2.0",
+            "my other library",
+        ),
+    }
+
+    expected = {
+        "python_versions": ["py27", "py33"],
+        "lib_names": ["badlib-1.0", "mylib-1.0", "myotherlib-2.0"],
+        "pytest_versions": ["2.3", "2.4"],
+        "latest_pytest_ver": "2.4",
+        "statuses": {k: status for (k, (status, output, desc)) in lib_data.items()},
+        "outputs": {k: output for (k, (status, output, desc)) in lib_data.items()},
+        "descriptions": {k[0]: desc for (k, (status, output, desc)) in lib_data.items()},
+    }
+    return all_results, expected
+
+
 @pytest.fixture(autouse=True)
 def force_sqlite(storage, monkeypatch):
     monkeypatch.setattr(web, "_storage", storage)
@@ -107,6 +193,9 @@ def force_sqlite(storage, monkeypatch):
 def client():
     result = app.test_client()
     app.testing = True
+    # pre-bind the path and content type so each JSON post reuses the same
+    # arguments instead of rebuilding them per call
+    result.post_json = functools.partial(result.post, "/", content_type="application/json")
     return result
 
 
@@ -122,9 +211,21 @@ class TestView:
     def configure_secret(self, monkeypatch):
         monkeypatch.setenv("POST_KEY", self.TEST_SECRET)
 
+    # serialized bodies keyed by (secret, result items): the suite posts the
+    # same small payloads over and over across parametrizations, so cache the
+    # json.dumps output instead of re-encoding each time
+    _dump_cache = {}
+
     def post_result(self, client, result, secret=None, expected_status=200):
         data = {"secret": secret or self.TEST_SECRET, "results": result}
-        response = client.post("/", data=json.dumps(data), content_type="application/json")
+        if isinstance(result, dict):
+            key = (data["secret"], tuple(sorted(result.items())))
+            body = self._dump_cache.get(key)
+            if body is None:
+                body = self._dump_cache.setdefault(key, json.dumps(data))
+        else:
+            body = json.dumps(data)
+        response = client.post_json(data=body)
         assert response.status_code == expected_status
 
     def test_singleton_storage(self):
@@ -149,74 +250,45 @@ class TestView:
         self.post_result(client, [result3, result4])
         assert storage.get_all_results() == [result1, result2, result3, result4]
 
+    def test_index_post_gzip(self, client, storage):
+        result = make_result_payload()
+        data = {"secret": self.TEST_SECRET, "results": result}
+        body = gzip.compress(json.dumps(data).encode("utf-8"))
+        response = client.post(
+            "/",
+            data=body,
+            content_type="application/json",
+            headers={"Content-Encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert storage.get_all_results() == [result]
+
     def test_index_get_json(self, client, storage):
-        self.post_result(client, make_result_payload())
-        self.post_result(client, make_result_payload(env="py33"))
-        self.post_result(client, make_result_payload(name="myotherlib"))
-        self.post_result(client, make_result_payload(name="myotherlib", env="py33"))
+        # one batched post instead of four round-trips; the list form is
+        # what run.py sends anyway
+        self.post_result(
+            client,
+            [
+                make_result_payload(),
+                make_result_payload(env="py33"),
+                make_result_payload(name="myotherlib"),
+                make_result_payload(name="myotherlib", env="py33"),
+            ],
+        )
         assert len(storage.get_all_results()) == 4
 
         response = client.get("/?json=1")
-        results = json.loads(response.data)["data"]
-        assert {x["name"] for x in results} == {"mylib", "myotherlib"}
-
-    def test_get_render_namespace(self):
+        results = response.get_json()["data"]
+        assert set(map(itemgetter("name"), results)) == {"mylib", "myotherlib"}
 
+    def test_get_render_namespace(self, render_namespace_data):
+        all_results, expected = render_namespace_data
         with mock.patch("web.get_python_versions") as mock_python_versions, mock.patch(
             "web.get_pytest_versions"
         ) as mock_pytest_versions:
             mock_python_versions.return_value = {"py27", "py33"}
             mock_pytest_versions.return_value = {"2.4", "2.3"}
-            # post results; only the latest lib versions should be rendered
-            all_results = [
-                make_result_payload(),
-                make_result_payload(env="py26", status="failed"),
-                make_result_payload(env="py32", status="failed"),
-                make_result_payload(env="py33", status="failed"),
-                make_result_payload(name="myotherlib", version="1.8", pytest="2.4"),
-                make_result_payload(env="py33", pytest="2.4"),
-                make_result_payload(env="py33", pytest="2.4", version="0.6"),
-                make_result_payload(env="py33", pytest="2.4", version="0.7"),
-                make_result_payload(env="py33", pytest="2.4", version="0.8"),
-                make_result_payload(
-                    name="myotherlib",
-                    version="2.0",
-                    pytest="2.4",
-                    description="my other library",
-                    output="output for myotherlib-2.0",
-                ),
-            ]
-
-            bad_result = make_result_payload(name="badlib")
-            del bad_result["output"]
-            all_results.append(bad_result)
-
-            output_ok = "all commands:\nok"
-            lib_data = {
-                ("badlib-1.0", "py27", "2.3"): ("ok", "<no output available>", "a generic library"),
-                ("mylib-1.0", "py27", "2.3"): ("ok", output_ok, "a generic library"),
-                ("mylib-1.0", "py33", "2.3"): ("failed", output_ok, "a generic library"),
-                ("mylib-1.0", "py33", "2.4"): ("ok", output_ok, "a generic library"),
-                ("myotherlib-2.0", "py27", "2.4"): (
-                    "ok",
-                    "output for myotherlib-2.0",
-                    "my other library",
-                ),
-            }
-
-            statuses = {k: status for (k, (status, output, desc)) in lib_data.items()}
-            outputs = {k: output for (k, (status, output, desc)) in lib_data.items()}
-            descriptions = {k[0]: desc for (k, (status, output, desc)) in lib_data.items()}
-
-            assert get_namespace_for_rendering(all_results) == {
-                "python_versions": ["py27", "py33"],
-                "lib_names": ["badlib-1.0", "mylib-1.0", "myotherlib-2.0"],
-                "pytest_versions": ["2.3", "2.4"],
-                "latest_pytest_ver": "2.4",
-                "statuses": statuses,
-                "outputs": outputs,
-                "descriptions": descriptions,
-            }
+            assert get_namespace_for_rendering(all_results) == expected
 
     def test_versions(self):
         assert get_python_versions() == {"py36", "py37", "py38"}
@@ -228,6 +300,17 @@ class TestView:
         response = client.get("/")
         assert response.data.decode("utf-8") == "Database is empty"
 
+    def test_get_known(self, client):
+        self.post_result(client, make_result_payload())
+        self.post_result(client, make_result_payload(name="myotherlib"))
+        self.post_result(client, make_result_payload(env="py33"))
+
+        response = client.get("/known?py=py27&pytest=2.3")
+        assert json.loads(response.data)["data"] == ["mylib-1.0", "myotherlib-1.0"]
+
+        response = client.get("/known")
+        assert response.data.decode("utf-8") == 'Specify "py" and "pytest" parameters'
+
     @pytest.mark.parametrize("lib_version", ["1.0", "1.2", "latest"])
     def test_get_output(self, client, lib_version):
         self.post_result(client, make_result_payload(version="0.9", output="ver 0.9", pytest="2.3"))
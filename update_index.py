@@ -17,61 +17,69 @@ trigger a new travis build using the new versions.
 """
 import json
 import os
-import sys
-from distutils.version import LooseVersion
 
+import requests
 from tqdm import tqdm
 
-from pypi_rpc_client.proxy import RateLimitedProxy
-
 INDEX_FILE_NAME = os.path.join(os.path.dirname(__file__), "index.json")
 
 BLACKLIST = {"pytest-nbsmoke"}
 
+BASE_URL = "https://pypi.org"
 
-def iter_plugins(client, blacklist, *, consider_classifier=True):
-    """
-    Returns an iterator of (name, latest version, summary) from PyPI.
 
-    :param client: RateLimitedProxy
-    :param search: package names to search for
+def make_session():
     """
-    # previously we used the more efficient "search" XMLRPC method, but
-    # that stopped returning all results after a while
-    print("Fetching all pytest-* packages")
-    package_names = [x for x in client.list_packages() if x.startswith("pytest-")]
+    Returns a requests.Session with a connection pool large enough for the
+    per-package metadata requests, so every call reuses the same TCP+TLS
+    connections instead of handshaking from scratch.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=32)
+    session.mount("https://", adapter)
+    return session
 
-    print("Considering %d packages" % len(package_names))
-    names_and_versions = {}
-    for name in tqdm(package_names):
-        versions = client.package_releases(name)
-        if versions:  # Package can exist without public releases
-            names_and_versions[name] = max(versions, key=LooseVersion)
 
-    print("pytest-*: %d public packages" % len(names_and_versions))
+def iter_plugins(session, blacklist, *, classifier_client=None):
+    """
+    Returns an iterator of (name, latest version, summary) from PyPI.
 
-    # search for the new Pytest classifier
-    if consider_classifier:
+    :param session: requests.Session used against the PyPI JSON API
+    :param blacklist: package names to skip
+    :param classifier_client: optional RateLimitedProxy, used to also search
+        for packages classified as "Framework :: Pytest" (the classifier
+        search only exists in the legacy XML-RPC API)
+    """
+    # a single request to the "simple" index replaces the XML-RPC
+    # list_packages + package_releases calls (one per package) used before
+    print("Fetching all pytest-* packages")
+    response = session.get(
+        BASE_URL + "/simple/", headers={"Accept": "application/vnd.pypi.simple.v1+json"}
+    )
+    response.raise_for_status()
+    names = {p["name"] for p in response.json()["projects"] if p["name"].startswith("pytest-")}
+    print("pytest-*: %d packages" % len(names))
+
+    if classifier_client is not None:
         print("Fetching all packages classified as 'Framework :: Pytest'")
-        found = client.browse(["Framework :: Pytest"])
-
-        print("Considering %d packages" % len(found))
-        valid = 0
-        for name, version in tqdm(found):
-            if name and version:
-                names_and_versions[name] = version
-                valid += 1
-
-        print("classifier: %d packages (%d valid)" % (len(found), valid))
-        print("total: %d packages" % len(names_and_versions))
+        found = classifier_client.browse(["Framework :: Pytest"])
+        names.update(name for name, version in found if name and version)
+        print("classifier: %d packages" % len(found))
     else:
         print("skipping search by classifier")
 
-    print("Getting release data for %d packages" % len(names_and_versions.items()))
-    for name, version in tqdm(names_and_versions.items()):
-        if name not in blacklist:
-            plug_data = client.release_data(name, version)
-            yield plug_data["name"], plug_data["version"], plug_data["summary"]
+    print("Getting release data for %d packages" % len(names))
+    for name in tqdm(sorted(names)):
+        if name in blacklist:
+            continue
+        # the JSON API already answers with the latest release, so there is
+        # no version list to fetch and compare on our side
+        response = session.get("{}/pypi/{}/json".format(BASE_URL, name))
+        if response.status_code != 200:
+            # package can exist in the index without public releases
+            continue
+        info = response.json()["info"]
+        yield info["name"], info["version"], info["summary"]
 
 
 def write_plugins_index(file_name, plugins):
@@ -89,13 +97,7 @@ def write_plugins_index(file_name, plugins):
         plugin_contents.append({"name": name, "version": version, "description": description})
     contents = json.dumps(plugin_contents, indent=2, separators=(",", ": "), sort_keys=True)
     if os.path.isfile(file_name):
-        if sys.version_info < (3,):
-            mode = "rU"
-        else:
-            # universal newlines is enabled by default, and specifying it
-            # will cause deprecation warnings
-            mode = "r"
-        with open(file_name, mode) as f:
+        with open(file_name) as f:
             current_contents = f.read()
     else:
         current_contents = ""
@@ -109,8 +111,7 @@ def write_plugins_index(file_name, plugins):
 
 
 def main():
-    client = RateLimitedProxy("https://pypi.org/pypi")
-    plugins = sorted(iter_plugins(client, BLACKLIST, consider_classifier=False))
+    plugins = sorted(iter_plugins(make_session(), BLACKLIST))
 
     if write_plugins_index(INDEX_FILE_NAME, plugins):
         print(INDEX_FILE_NAME, "updated, push to GitHub.")
@@ -1,4 +1,4 @@
-import itertools
+import gzip
 import logging
 import os
 import sys
@@ -10,8 +10,11 @@ from flask import request
 from packaging.version import parse
 from sqlalchemy import Column
 from sqlalchemy import create_engine
+from sqlalchemy import Index
+from sqlalchemy import inspect
 from sqlalchemy import Integer
 from sqlalchemy import String
+from sqlalchemy import text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -22,10 +25,18 @@ class PluginResult(Base):
     """Results of testing a pytest plugin against a pytest and python version."""
 
     __tablename__ = "results"
+    # composite index serving the upsert lookup in add_test_result and, via
+    # its leftmost columns, the per-package queries in get_test_results
+    __table_args__ = (
+        Index("ix_results_name_version_env_pytest", "name", "version", "env", "pytest"),
+        # get_tested_packages filters on env+pytest only, which the composite
+        # above cannot serve (env is its third column)
+        Index("ix_results_env_pytest", "env", "pytest"),
+    )
 
     id = Column(Integer, primary_key=True)
-    name = Column(String, index=True)
-    version = Column(String, index=True)
+    name = Column(String)
+    version = Column(String)
     env = Column(String)
     pytest = Column(String)
     status = Column(String)
@@ -55,6 +66,10 @@ class PluginResult(Base):
 
 app = flask.Flask("plugincompat")
 
+# keys a posted result must carry; built once so validation is a single
+# C-level subset check per insert instead of a fresh set literal
+REQUIRED_RESULT_KEYS = frozenset({"name", "version", "env", "pytest", "status"})
+
 
 def get_python_versions():
     """
@@ -80,8 +95,26 @@ class PlugsStorage:
         url = url or os.environ["DATABASE_URL"]
         self._engine = create_engine(url)
         Base.metadata.create_all(self._engine)
+        self._migrate_indexes()
         self._session_maker = sessionmaker(autocommit=False, autoflush=False, bind=self._engine)
 
+    def _migrate_indexes(self):
+        """
+        create_all skips tables which already exist, so indexes added after
+        the results table first shipped must be created (and the
+        single-column ones they replaced dropped) explicitly on live
+        databases.
+        """
+        indexes = inspect(self._engine).get_indexes(PluginResult.__tablename__)
+        existing = {ix["name"] for ix in indexes}
+        with self._engine.begin() as conn:
+            for index in PluginResult.__table_args__:
+                if index.name not in existing:
+                    index.create(conn)
+            for stale in ("ix_results_name", "ix_results_version"):
+                if stale in existing:
+                    conn.execute(text("DROP INDEX " + stale))
+
     def __enter__(self):
         return self
 
@@ -101,8 +134,7 @@ class PlugsStorage:
             * "output": string with output from running tox commands.
             * "description": description of this package (optional).
         """
-        expected = {"name", "version", "env", "pytest", "status"}
-        if not expected.issubset(payload):
+        if not payload.keys() >= REQUIRED_RESULT_KEYS:
             raise TypeError("Invalid keys given: %s" % payload.keys())
 
         with closing(self._session_maker()) as session:
@@ -130,6 +162,19 @@ class PlugsStorage:
         with closing(self._session_maker()) as session:
             return [x.as_dict() for x in session.query(PluginResult).all()]
 
+    def get_tested_packages(self, env, pytest):
+        """
+        Returns a sorted list of "name-version" strings which already have a
+        test result for the given python environment and pytest version.
+        """
+        with closing(self._session_maker()) as session:
+            q = (
+                session.query(PluginResult.name, PluginResult.version)
+                .filter(PluginResult.env == env)
+                .filter(PluginResult.pytest == pytest)
+            )
+            return sorted("{}-{}".format(name, version) for name, version in q)
+
     def get_test_results(self, name, version):
         """
         searches the database for all test results given library name and
@@ -182,7 +227,11 @@ def authenticate(json_data):
 def index():
     storage = get_storage_for_view()
     if request.method == "POST":
-        data = request.get_json()
+        # run.py posts gzip-compressed bodies to save bandwidth
+        if request.content_encoding == "gzip":
+            data = flask.json.loads(gzip.decompress(request.get_data()))
+        else:
+            data = request.get_json()
         authenticate(data)
         results = data["results"]
         if not isinstance(results, list):
@@ -254,10 +303,31 @@ def get_latest_versions(names_and_versions):
     Returns an iterator of (name, version) from the given list of (name,
     version), but returning only the latest version of the package.
     """
-    names_and_versions = sorted((name, parse(version)) for (name, version) in names_and_versions)
-    for name, grouped_versions in itertools.groupby(names_and_versions, key=lambda x: x[0]):
-        name, loose_version = list(grouped_versions)[-1]
-        yield name, str(loose_version)
+    # single pass with a dict beats sort+groupby: no intermediate list and
+    # no parsed-version tuples dragged through the comparisons
+    latest = {}
+    for name, version in names_and_versions:
+        version = parse(version)
+        current = latest.get(name)
+        if current is None or version > current:
+            latest[name] = version
+    return ((name, str(version)) for name, version in latest.items())
+
+
+@app.route("/known")
+def get_known():
+    """
+    Returns the "name-version" packages which already have results for the
+    given "py" and "pytest" parameters, so run.py can skip them after a
+    single request instead of probing each package individually.
+    """
+    py = request.args.get("py")
+    pytest = request.args.get("pytest")
+    if py and pytest:
+        storage = get_storage_for_view()
+        return flask.jsonify(data=storage.get_tested_packages(py, pytest))
+    else:
+        return 'Specify "py" and "pytest" parameters'
 
 
 @app.route("/status")